@@ -10,22 +10,93 @@ Author: rkgcode
 Version: 1.0.0
 """
 
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request
+from fastapi.responses import FileResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
+import asyncio
+import hashlib
+import multiprocessing
 import os
-import shutil
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
 from tempfile import NamedTemporaryFile
-from utils import compress_tiff_file
+from utils import compress_tiff_file, init_worker
 from pathlib import Path
 
+# Chunk size used when streaming uploads to disk
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Compression worker processes, one per core
+WORKERS = os.cpu_count() or 1
+
+def create_executor() -> ProcessPoolExecutor:
+    """
+    Worker processes for the CPU-bound compression, so it never blocks the event loop.
+    
+    One single-threaded worker per core. Spawned rather than forked: OpenCV's
+    thread pool is not fork-safe.
+    """
+    return ProcessPoolExecutor(
+        max_workers=WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker
+    )
+
+def submit_compression(app: FastAPI, *args) -> Future:
+    """
+    Submit a compress_tiff_file call to the application's worker pool.
+    
+    A worker that dies (e.g. killed for running out of memory) breaks the
+    whole pool for good, so a broken pool is replaced before submitting.
+    """
+    try:
+        return app.state.executor.submit(compress_tiff_file, *args)
+    except BrokenProcessPool:
+        app.state.executor.shutdown(wait=False)
+        app.state.executor = create_executor()
+        return app.state.executor.submit(compress_tiff_file, *args)
+
+def copy_upload(source, destination) -> str:
+    """
+    Copy an upload to disk in fixed-size chunks and hash it on the way.
+    
+    Returns:
+        str: SHA-256 hex digest of the upload, which keys the decode cache
+    """
+    digest = hashlib.sha256()
+    while chunk := source.read(UPLOAD_CHUNK_SIZE):
+        digest.update(chunk)
+        destination.write(chunk)
+    return digest.hexdigest()
+
+def remove_files(*paths: str) -> None:
+    """Delete temporary files, ignoring any that are already gone."""
+    for path in paths:
+        Path(path).unlink(missing_ok=True)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Start the compression workers with the application and shut them down with it.
+    
+    Created here rather than at import, since spawned workers and uvicorn
+    import this module again and would each build an idle pool of their own.
+    """
+    app.state.executor = create_executor()
+    yield
+    app.state.executor.shutdown(cancel_futures=True)
+
 # Initialize FastAPI application
 app = FastAPI(
     title="TIFF Compressor API",
     description="A FastAPI service for compressing TIFF files while preserving image quality",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -65,6 +136,7 @@ app.add_middleware(
     }
 )
 async def compress_tiff(
+    request: Request,
     file: UploadFile = File(..., description="TIFF file to compress"),
     target_size_kb: int = Form(..., description="Target file size in kilobytes", gt=0),
     min_size_percentage: float = Form(0.3, description="Minimum size percentage of original (0.1 to 1.0)", gt=0.1, le=1.0),
@@ -100,20 +172,31 @@ async def compress_tiff(
             detail="Only TIFF files are supported"
         )
     
+    # Temporary files are removed once the response has been sent, or right
+    # away if anything (including cancellation) stops us before that
+    temp_paths = []
+    compression = None
+    response_returned = False
+    
     try:
         # Create temporary input file
         with NamedTemporaryFile(delete=False, suffix='.tiff') as temp_input:
-            # Copy uploaded file content
-            shutil.copyfileobj(file.file, temp_input)
+            temp_paths.append(temp_input.name)
+            # Stream uploaded file content to disk in fixed-size chunks,
+            # hashing it on the way so repeat uploads hit the decode cache;
+            # the whole copy runs in one thread off the event loop
+            source_digest = await asyncio.to_thread(copy_upload, file.file, temp_input)
             temp_input_path = temp_input.name
         
         # Create temporary output file
         with NamedTemporaryFile(delete=False, suffix='.tiff') as temp_output:
+            temp_paths.append(temp_output.name)
             temp_output_path = temp_output.name
         
         try:
-            # Compress the file
-            output_file = compress_tiff_file(
+            # Compress the file in a worker process
+            compression = submit_compression(
+                request.app,
                 temp_input_path,
                 target_size_kb,
                 min_size_percentage,
@@ -121,16 +204,22 @@ async def compress_tiff(
                 sharpness_factor,
                 contrast_factor,
                 blur_radius,
-                dpi
+                dpi,
+                source_digest,
+                temp_output_path
             )
+            output_file = await asyncio.wrap_future(compression)
             
             # Return the compressed file
-            return FileResponse(
+            response = FileResponse(
                 output_file,
                 media_type="image/tiff",
                 filename=f"compressed_{file.filename}",
-                headers={"Content-Disposition": f'attachment; filename="compressed_{file.filename}"'}
+                headers={"Content-Disposition": f'attachment; filename="compressed_{file.filename}"'},
+                background=BackgroundTask(remove_files, *temp_paths)
             )
+            response_returned = True
+            return response
             
         except Exception as e:
             raise HTTPException(
@@ -143,20 +232,13 @@ async def compress_tiff(
             status_code=500,
             detail=f"Error processing file: {str(e)}"
         )
-        
+    
     finally:
-        # Clean up temporary files
-        file.file.close()
-        if 'temp_input_path' in locals():
-            try:
-                os.unlink(temp_input_path)
-            except:
-                pass
-        if 'temp_output_path' in locals():
-            try:
-                os.unlink(temp_output_path)
-            except:
-                pass
+        if not response_returned:
+            remove_files(*temp_paths)
+            if compression is not None and not compression.done():
+                # Cancelled while a worker is still writing the output; clean up after it
+                compression.add_done_callback(lambda _: remove_files(*temp_paths))
 
 @app.get("/", 
     tags=["Root"],
@@ -177,4 +259,11 @@ async def read_root():
             "/compress": "POST endpoint to compress TIFF files",
             "/": "This information endpoint"
         }
-    }
\ No newline at end of file
+    }
+
+if __name__ == "__main__":
+    import uvicorn
+    
+    # uvicorn picks uvloop and httptools over the pure-Python event loop and
+    # HTTP parser whenever they are installed (uvloop is not on Windows)
+    uvicorn.run(app, host="0.0.0.0", port=8000)
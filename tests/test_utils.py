@@ -0,0 +1,255 @@
+"""
+Regression tests for the enhancement pipeline and size search in utils.py.
+
+The OpenCV pipeline must stay interchangeable with the Pillow enhancers it
+replaces: ImageEnhance.Sharpness, then ImageEnhance.Contrast, then
+ImageFilter.GaussianBlur.
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageEnhance, ImageFilter
+
+import utils
+
+# Largest per-pixel difference from Pillow allowed, in grey levels
+MAX_LEVEL_DIFFERENCE = 3
+
+def _document(mode: str, size=(480, 360)) -> Image.Image:
+    """Noisy scanned-page stand-in: dark text and lines on a light background."""
+    rng = np.random.default_rng(0)
+    img = Image.new("RGB", size, (245, 240, 230))
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        x, y = rng.integers(0, size[0]), rng.integers(0, size[1])
+        draw.text((int(x), int(y)), "Lorem ipsum 0123", fill=tuple(int(v) for v in rng.integers(0, 120, 3)))
+        draw.line(
+            [tuple(int(v) for v in rng.integers(0, min(size), 2)) for _ in range(2)],
+            fill=(0, 0, 0)
+        )
+    noisy = np.asarray(img) + rng.normal(0, 12, (size[1], size[0], 3))
+    img = Image.fromarray(np.clip(noisy, 0, 255).astype(np.uint8))
+    if mode in ("LA", "RGBA"):
+        img = img.convert(mode[:-1])
+        img.putalpha(Image.linear_gradient("L").resize(size))
+        return img
+    return img.convert(mode)
+
+def _pillow_enhance(img: Image.Image, sharpness_factor, contrast_factor, blur_radius) -> Image.Image:
+    img = ImageEnhance.Sharpness(img).enhance(sharpness_factor)
+    img = ImageEnhance.Contrast(img).enhance(contrast_factor)
+    if blur_radius > 0:
+        img = img.filter(ImageFilter.GaussianBlur(radius=blur_radius))
+    return img
+
+@pytest.mark.parametrize("mode", ["L", "RGB", "CMYK"])
+@pytest.mark.parametrize("blur_radius", [0.0, 0.1, 0.5, 1.0, 1.5, 2.0])
+@pytest.mark.parametrize("sharpness_factor, contrast_factor", [(1.5, 1.5), (0.5, 0.8), (3.0, 3.0)])
+def test_enhance_matches_pillow(mode, blur_radius, sharpness_factor, contrast_factor):
+    img = _document(mode)
+    expected = np.asarray(_pillow_enhance(img, sharpness_factor, contrast_factor, blur_radius))
+    actual = np.asarray(utils._enhance_image(img, sharpness_factor, contrast_factor, blur_radius))
+
+    difference = np.abs(expected.astype(int) - actual.astype(int))
+    assert difference.max() <= MAX_LEVEL_DIFFERENCE
+
+@pytest.mark.parametrize("mode", ["LA", "RGBA"])
+def test_enhance_keeps_alpha(mode):
+    img = _document(mode)
+    enhanced = utils._enhance_image(img, 1.5, 1.5, 1.0)
+
+    assert enhanced.mode == mode
+    assert np.array_equal(np.asarray(enhanced.getchannel("A")), np.asarray(img.getchannel("A")))
+
+@pytest.mark.parametrize("blur_radius", [0.0, 0.5, 2.0])
+def test_enhance_tiles_join_seamlessly(monkeypatch, blur_radius):
+    arr = np.asarray(_document("RGB"))
+    monkeypatch.setattr(utils, "_tile_threads", 1)
+    single = np.empty_like(arr)
+    utils._enhance(arr, single, 1.5, 1.5, blur_radius)
+
+    monkeypatch.setattr(utils, "_tile_threads", 5)
+    tiled = np.empty_like(arr)
+    utils._enhance(arr, tiled, 1.5, 1.5, blur_radius)
+
+    assert np.array_equal(single, tiled)
+
+@pytest.fixture
+def source_cache(monkeypatch, tmp_path):
+    """Point the decoded source cache at an empty directory holding two 100x100 greyscale sources."""
+    cache_dir = tmp_path / "cache"
+    monkeypatch.setattr(utils, "SOURCE_CACHE_DIR", cache_dir)
+    monkeypatch.setattr(utils, "SOURCE_CACHE_BYTES", 2 * 100 * 100 + 1024)
+    return cache_dir
+
+@pytest.mark.parametrize("mode", ["L", "LA", "RGB", "RGBA", "CMYK"])
+def test_cached_source_is_mapped_on_repeat(source_cache, tmp_path, mode):
+    path = tmp_path / "scan.tiff"
+    img = _document(mode, size=(40, 30))
+    img.save(path, compression="tiff_adobe_deflate")
+    decoded = utils._load_source(path, "digest")
+    path.unlink()
+
+    cached = utils._load_source(path, "digest")
+
+    assert cached.mode == mode
+    assert np.array_equal(np.asarray(cached), np.asarray(decoded))
+
+def test_source_cache_evicts_least_recently_used(source_cache, tmp_path):
+    paths = []
+    for shade in range(3):
+        path = tmp_path / f"{shade}.tiff"
+        Image.new("L", (100, 100), shade).save(path, compression="tiff_adobe_deflate")
+        paths.append(path)
+
+    for shade, path in enumerate(paths[:2]):
+        utils._load_source(path, f"digest{shade}")
+    utils._load_source(paths[0], "digest0")
+    utils._load_source(paths[2], "digest2")
+
+    assert sorted(path.stem for path in source_cache.glob("*.tiff")) == ["digest0", "digest2"]
+    assert not list(source_cache.glob("*.part"))
+
+@pytest.mark.parametrize("mode", ["L", "RGB", "RGBA"])
+@pytest.mark.parametrize("blur_radius", [0.0, 0.1, 0.5, 1.0, 2.0])
+def test_vips_enhance_matches_pillow_pipeline(monkeypatch, mode, blur_radius):
+    try:
+        pyvips = pytest.importorskip("pyvips")
+    except OSError:
+        # The pyvips package is installed but the libvips library is not
+        pytest.skip("libvips is not installed")
+    monkeypatch.setattr(utils, "pyvips", pyvips)
+    img = _document(mode)
+    arr = np.asarray(img)
+    source = pyvips.Image.new_from_array(arr, interpretation="b-w" if mode == "L" else "srgb")
+
+    expected = np.asarray(utils._enhance_image(img, 1.5, 1.5, blur_radius))
+    actual = utils._vips_enhance(source, 1.5, 1.5, blur_radius).numpy().reshape(expected.shape)
+
+    difference = np.abs(expected.astype(int) - actual.astype(int))
+    assert difference.max() <= MAX_LEVEL_DIFFERENCE
+
+@pytest.mark.parametrize("foreign", [False, True])
+def test_unsafe_cache_dir_is_not_used(monkeypatch, source_cache, tmp_path, foreign):
+    path = tmp_path / "scan.tiff"
+    Image.new("L", (100, 100), 200).save(path, compression="tiff_adobe_deflate")
+    source_cache.mkdir()
+    Image.new("L", (100, 100), 0).save(source_cache / "digest.tiff")
+    if foreign:
+        monkeypatch.setattr(utils.os, "getuid", lambda: source_cache.stat().st_uid + 1)
+    else:
+        source_cache.chmod(0o777)
+
+    base = utils._load_source(path, "digest")
+
+    assert np.asarray(base)[0, 0] == 200
+    assert [entry.name for entry in source_cache.iterdir()] == ["digest.tiff"]
+
+def test_memmapped_source_is_not_cached(source_cache, tmp_path):
+    path = tmp_path / "raw.tiff"
+    Image.new("RGB", (100, 100), (10, 20, 30)).save(path)
+
+    base = utils._load_source(path, "digest")
+
+    assert np.asarray(base)[0, 0].tolist() == [10, 20, 30]
+    assert not list(source_cache.glob("*"))
+
+def test_memmapped_source_checks_decompression_bomb(monkeypatch, tmp_path):
+    path = tmp_path / "raw.tiff"
+    Image.new("L", (100, 100)).save(path)
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 100 * 100 // 3)
+
+    with pytest.raises(Image.DecompressionBombError):
+        utils._load_source(path)
+
+def test_blur_kernel_is_read_only():
+    kernel = utils._box_blur_kernel1d(1.0)
+
+    with pytest.raises(ValueError):
+        kernel[0] = 0
+    assert utils._box_blur_kernel1d(1.0) is kernel
+
+def test_non_tiff_content_falls_back_to_pillow(tmp_path):
+    path = tmp_path / "scan.tif"
+    Image.new("RGB", (100, 100), (10, 20, 30)).save(path, format="PNG")
+
+    base = utils._load_source(path)
+
+    assert base.mode == "RGB"
+    assert np.asarray(base)[0, 0].tolist() == [10, 20, 30]
+
+@pytest.mark.parametrize("blur_radius", [0.0, 2.0])
+def test_enhance_in_place_matches_separate_output(blur_radius):
+    arr = np.array(_document("RGB"))
+    out = np.empty_like(arr)
+    utils._enhance(arr, out, 1.5, 1.5, blur_radius)
+
+    utils._enhance(arr, arr, 1.5, 1.5, blur_radius)
+
+    assert np.array_equal(arr, out)
+
+def _fake_encoder(monkeypatch, size_at_scale):
+    """Replace the encoder with one producing ``size_at_scale(scale)`` bytes; returns the probed scales."""
+    scales = []
+
+    def encode_scaled(base, scale_factor, *args):
+        scales.append(scale_factor)
+        return bytes(size_at_scale(scale_factor))
+
+    monkeypatch.setattr(utils, "_encode_scaled", encode_scaled)
+    return scales
+
+def test_size_search_bisects_when_the_model_stalls(monkeypatch, tmp_path):
+    source = tmp_path / "scan.tiff"
+    Image.new("1", (100, 100)).save(source, compression="tiff_adobe_deflate")
+    target_bytes = 1000 * 1024
+    # Antialiasing keeps the size just over target down to 0.75, then it drops
+    scales = _fake_encoder(
+        monkeypatch,
+        lambda scale: int(target_bytes * (1.015 if scale > 0.75 else 0.99 * (scale / 0.75) ** 2))
+    )
+    monkeypatch.setattr(utils, "_estimate_scale", lambda *args: 1.0)
+
+    output = utils.compress_tiff_file(source, 1000, output_file=tmp_path / "out.tiff")
+
+    size = Path(output).stat().st_size
+    assert 0.9 * target_bytes <= size <= target_bytes
+    assert min(scales) > 0.3
+
+def _busy_center_page(path: Path) -> None:
+    """Plain paper with a dense figure filling the estimate's center crop."""
+    rng = np.random.default_rng(0)
+    page = np.full((1500, 1200), 240, dtype=np.uint8)
+    page[494:1006, 344:856] = rng.integers(0, 256, (512, 512))
+    Image.fromarray(page).save(path, compression="tiff_adobe_deflate")
+
+def test_size_search_scales_up_when_the_center_is_busier(tmp_path):
+    source = tmp_path / "scan.tiff"
+    _busy_center_page(source)
+
+    output = utils.compress_tiff_file(source, 150, output_file=tmp_path / "out.tiff")
+
+    size = Path(output).stat().st_size
+    assert utils.SCALE_FILL_RATIO * 150 * 1024 <= size <= 150 * 1024
+
+def test_size_search_stays_within_the_scale_factor(tmp_path):
+    source = tmp_path / "scan.tiff"
+    _busy_center_page(source)
+
+    output = utils.compress_tiff_file(source, 600, scale_factor=0.9, output_file=tmp_path / "out.tiff")
+
+    with Image.open(output) as img:
+        assert img.size == (1080, 1350)
+
+@pytest.mark.parametrize("compression", [None, "tiff_adobe_deflate"])
+@pytest.mark.parametrize("mode", ["LA", "CMYK"])
+def test_compress_keeps_the_source_mode(tmp_path, mode, compression):
+    source = tmp_path / "scan.tiff"
+    _document(mode).save(source, compression=compression)
+
+    output = utils.compress_tiff_file(source, 100, output_file=tmp_path / "out.tiff")
+
+    with Image.open(output) as img:
+        assert img.mode == mode
@@ -8,16 +8,699 @@ while achieving the desired file size reduction.
 
 Functions:
     compress_tiff_file: Main function for TIFF compression with quality preservation
+    init_worker: Limit a pool worker process to a single pipeline thread
 
 Author: rkgcode
 Version: 1.0.0
 """
 
-from PIL import Image, ImageEnhance, ImageFilter
+from PIL import Image
+import cv2
+import numpy as np
+import tifffile
+import io
+import math
 import os
-from typing import Union
+import stat
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional, Tuple, Union
 from pathlib import Path
 
+# Image pipeline: "pillow" (Pillow + OpenCV, the default) or "vips". The libvips
+# pipeline streams large sources in tiles and enhances them the same way, but it
+# resizes with its own Lanczos kernel and bypasses the decoded source cache, the
+# memory-mapped loader and the row tiling, so it has to be asked for.
+BACKEND = os.environ.get("TIFF_COMPRESSOR_BACKEND", "pillow")
+if BACKEND not in ("pillow", "vips"):
+    raise ValueError(f"Unknown TIFF_COMPRESSOR_BACKEND: {BACKEND}")
+
+pyvips = None
+if BACKEND == "vips":
+    # Needs the libvips shared library as well as the pyvips package
+    import pyvips
+
+# Smallest scale factor the size search will go down to
+MIN_SCALE_FACTOR = 0.1
+
+# Number of model-guided re-encodes before falling back to bisection
+MAX_SCALE_PROBES = 3
+
+# Bisection steps between the largest fitting (or smallest allowed) and the
+# smallest over-target scale
+MAX_BISECTION_STEPS = 4
+
+# Fraction of the target an encode must reach to be accepted without scaling
+# back up towards the caller's scale factor
+SCALE_FILL_RATIO = 0.85
+
+# Aim slightly below the target so the size model's error rarely costs an extra encode
+SCALE_SAFETY_MARGIN = 0.97
+
+# Pillow's reducing_gap for resizes: large downscales first shrink by an integer
+# factor with a cheap box reduce, leaving at least this factor for Lanczos
+RESIZE_REDUCING_GAP = 3.0
+
+# Side length of the center crop encoded to estimate the compressed bytes per pixel
+ESTIMATE_CROP_SIZE = 512
+
+# TIFF Predictor tag value for horizontal differencing; neighbouring pixels are
+# stored as deltas, which Deflate compresses far better than raw samples
+TIFF_PREDICTOR_TAG = 317
+HORIZONTAL_PREDICTOR = 2
+
+# PIL's ImageFilter.SMOOTH kernel as a 3x3 matrix, which ImageEnhance.Sharpness blends against
+SMOOTH_MATRIX = [[1, 1, 1], [1, 5, 1], [1, 1, 1]]
+SMOOTH_SCALE = 13
+SMOOTH_KERNEL = np.array(SMOOTH_MATRIX, dtype=np.float32) / SMOOTH_SCALE
+
+# Image.blend truncates where OpenCV rounds; this offset turns one into the
+# other, short of the bias itself so exact integers are not rounded down
+TRUNCATE_BIAS = -0.499
+
+# Smallest Gaussian mask amplitude libvips keeps; close to the +/- 3 sigma cut-off
+VIPS_GAUSS_MIN_AMPL = 0.01
+
+# Image modes the enhancement pipeline works in; anything else is converted on load
+WORKING_MODES = ("L", "LA", "RGB", "RGBA", "CMYK")
+
+# Modes with an alpha band, which is split off before enhancing -> the mode enhanced
+ALPHA_MODES = {"LA": "L", "RGBA": "RGB"}
+
+# Box blur passes ImageFilter.GaussianBlur approximates a Gaussian with
+BLUR_PASSES = 3
+BLUR_WEIGHT_BITS = 24
+
+# Smallest row tile worth handing to a thread in the OpenCV pipeline
+TILE_MIN_ROWS = 64
+
+# Threads for the tiled OpenCV pipeline; OpenCV releases the GIL inside its kernels.
+# Lowered to one by init_worker() in processes that share the cores with a pool.
+_tile_threads = os.cpu_count() or 1
+_tile_executor = ThreadPoolExecutor(max_workers=_tile_threads)
+
+# ITU-R 601-2 luma weights, as used by PIL's "L" conversion
+LUMA_WEIGHTS = (0.299, 0.587, 0.114)
+
+# (photometric, samples per pixel) -> (extra samples, mode) of the uncompressed
+# 8-bit TIFF layouts that map directly onto a working-mode image
+MEMMAP_LAYOUTS = {
+    (tifffile.PHOTOMETRIC.MINISBLACK, 1): ((), "L"),
+    (tifffile.PHOTOMETRIC.MINISBLACK, 2): ((tifffile.EXTRASAMPLE.UNASSALPHA,), "LA"),
+    (tifffile.PHOTOMETRIC.RGB, 3): ((), "RGB"),
+    (tifffile.PHOTOMETRIC.RGB, 4): ((tifffile.EXTRASAMPLE.UNASSALPHA,), "RGBA"),
+    (tifffile.PHOTOMETRIC.SEPARATED, 4): ((), "CMYK"),
+}
+
+# Decoded sources are cached on disk as uncompressed TIFFs named after the
+# SHA-256 of the upload, so every process on the host shares them and maps
+# them back through _memmap_source (and the OS page cache). Cached pixels are
+# trusted, so the directory is only used while private to this user.
+SOURCE_CACHE_DIR = Path(os.environ.get(
+    "TIFF_COMPRESSOR_CACHE_DIR",
+    Path(tempfile.gettempdir()) / "tiff-compressor-cache"
+))
+
+# Upper bound on the decoded sources kept in SOURCE_CACHE_DIR
+SOURCE_CACHE_BYTES = 2 * 1024 ** 3
+
+def init_worker() -> None:
+    """
+    Run the pipeline on a single thread in this process.
+    
+    Meant as a process pool initializer: with one worker per core, letting
+    each worker also start a thread per core for OpenCV, libvips and the row
+    tiles would only oversubscribe the CPU.
+    """
+    global _tile_threads
+    _tile_threads = 1
+    cv2.setNumThreads(1)
+    if pyvips is not None:
+        pyvips.concurrency_set(1)
+
+def _to_working_mode(img: Image.Image) -> Image.Image:
+    """Convert ``img`` to an 8-bit mode the enhancement pipeline supports."""
+    if img.mode in WORKING_MODES:
+        return img
+    if img.mode.startswith("I;16"):
+        # convert("L") clips 16-bit samples instead of scaling them; keep the high byte
+        return Image.fromarray((np.asarray(img) >> 8).astype(np.uint8))
+    if img.mode in ("I", "F"):
+        raise ValueError(f"Unsupported image mode: {img.mode}")
+    if "A" in img.getbands() or "transparency" in img.info:
+        return img.convert("RGBA")
+    if len(img.getbands()) == 1 and img.mode != "P":
+        return img.convert("L")
+    return img.convert("RGB")
+
+def _image_nbytes(img: Image.Image) -> int:
+    """Size of the decoded pixel buffer of an 8-bit image."""
+    return img.width * img.height * len(img.getbands())
+
+def _memmap_source(input_file: Path) -> Optional[Image.Image]:
+    """
+    Map the pixels of an uncompressed 8-bit TIFF straight from disk.
+    
+    Returns None for compressed or otherwise non-trivial layouts, and for
+    files tifffile cannot parse, which need Pillow's decoder.
+    """
+    try:
+        with tifffile.TiffFile(input_file) as tif:
+            page = tif.pages[0]
+            extrasamples, mode = MEMMAP_LAYOUTS.get(
+                (page.photometric, page.samplesperpixel), (None, None)
+            )
+            if (
+                not page.is_memmappable
+                or page.dtype != np.uint8
+                or page.planarconfig != tifffile.PLANARCONFIG.CONTIG
+                or extrasamples != tuple(page.extrasamples)
+            ):
+                return None
+            size = (page.imagewidth, page.imagelength)
+    except (tifffile.TiffFileError, ValueError):
+        # Not a TIFF to tifffile (e.g. a PNG saved as .tif); Image.open may still read it
+        return None
+    
+    # Same MAX_IMAGE_PIXELS guard Image.open applies to decoded sources
+    Image._decompression_bomb_check(size)
+    
+    # Skips the strip decoder either way, but only "L", "RGBA" and "CMYK" images
+    # wrap the mapping without a copy; Pillow stores RGB and LA with padding
+    # bytes, so their pixels are copied into memory
+    mapped = tifffile.memmap(input_file, page=0, mode="r")
+    return Image.frombuffer(mode, size, mapped, "raw", mode, 0, 1)
+
+def _private_cache_dir() -> bool:
+    """
+    Create SOURCE_CACHE_DIR for this user only and check nobody else can write to it.
+    
+    The default location is predictable, so another local user may have
+    created it first to plant pixels for known uploads; caching is skipped
+    then rather than trusting its content.
+    """
+    try:
+        SOURCE_CACHE_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+        info = os.lstat(SOURCE_CACHE_DIR)
+    except OSError:
+        return False
+    if not stat.S_ISDIR(info.st_mode):
+        # A symlink could point anywhere
+        return False
+    if not hasattr(os, "getuid"):
+        # Windows: the temp directory is per user already, and it has no mode bits
+        return True
+    return info.st_uid == os.getuid() and not info.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+def _touch(path: Path) -> None:
+    """Mark a cached source as just used; nanoseconds keep quick successive uses in order."""
+    now = time.time_ns()
+    os.utime(path, ns=(now, now))
+
+def _evict_sources() -> None:
+    """Delete the least recently used cached sources until the cache fits SOURCE_CACHE_BYTES."""
+    entries = []
+    for path in SOURCE_CACHE_DIR.glob("*.tiff"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            # Evicted by another process meanwhile
+            continue
+        entries.append((stat.st_mtime_ns, stat.st_size, path))
+    
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= SOURCE_CACHE_BYTES:
+            break
+        try:
+            path.unlink(missing_ok=True)
+        except OSError:
+            # Still mapped by a request on Windows; try again on the next store
+            continue
+        total -= size
+
+def _cache_source(source_digest: str, img: Image.Image) -> None:
+    """Store a decoded working-mode image in SOURCE_CACHE_DIR in a layout _memmap_source maps."""
+    if _image_nbytes(img) > SOURCE_CACHE_BYTES or not _private_cache_dir():
+        return
+    
+    part = None
+    try:
+        # Written under a temporary name and renamed, so no process maps a partial file
+        photometric, extrasamples = next(
+            (photometric, extrasamples)
+            for (photometric, _), (extrasamples, mode) in MEMMAP_LAYOUTS.items()
+            if mode == img.mode
+        )
+        with tempfile.NamedTemporaryFile(dir=SOURCE_CACHE_DIR, suffix=".part", delete=False) as part:
+            tifffile.imwrite(
+                part,
+                np.asarray(img),
+                photometric=photometric,
+                extrasamples=extrasamples or None
+            )
+        cached = SOURCE_CACHE_DIR / f"{source_digest}.tiff"
+        os.replace(part.name, cached)
+        _touch(cached)
+        _evict_sources()
+    except OSError:
+        # The cache only saves work; a full or read-only disk must not fail the request
+        if part is not None:
+            Path(part.name).unlink(missing_ok=True)
+
+def _load_source(input_file: Path, source_digest: Optional[str] = None) -> Image.Image:
+    """
+    Decode ``input_file`` into a working-mode image.
+    
+    When ``source_digest`` is given, a decoded image is cached on disk under
+    it, so that resubmitting the same file with other parameters, to any
+    worker process, maps the decoded pixels instead of decoding again.
+    """
+    if source_digest is not None and _private_cache_dir():
+        cached = SOURCE_CACHE_DIR / f"{source_digest}.tiff"
+        try:
+            _touch(cached)
+            base = _memmap_source(cached)
+        except FileNotFoundError:
+            base = None
+        if base is not None:
+            return base
+    
+    # Uncompressed sources skip Pillow's strip decoder. They are not cached:
+    # mapping the upload costs no more than mapping a cached copy of it.
+    base = _memmap_source(input_file)
+    if base is not None:
+        return base
+    
+    with Image.open(input_file) as base:
+        base.load()
+    base = _to_working_mode(base)
+    
+    if source_digest is not None:
+        _cache_source(source_digest, base)
+    
+    return base
+
+def _is_cmyk(arr: np.ndarray) -> bool:
+    """Whether a pipeline array holds CMYK; alpha is split off before enhancing, so four channels mean CMYK."""
+    return arr.ndim == 3 and arr.shape[2] == 4
+
+def _mean_grey(arr: np.ndarray) -> int:
+    """Mean grey level of an 8-bit image, rounded the way ImageEnhance.Contrast does."""
+    if _is_cmyk(arr):
+        # Pillow converts CMYK to greyscale through RGB; use its conversion as is
+        height, width = arr.shape[:2]
+        cmyk = Image.frombuffer("CMYK", (width, height), arr, "raw", "CMYK", 0, 1)
+        return int(cv2.mean(np.asarray(cmyk.convert("L")))[0] + 0.5)
+    means = cv2.mean(arr)
+    if arr.ndim == 2:
+        return int(means[0] + 0.5)
+    return int(sum(w * m for w, m in zip(LUMA_WEIGHTS, means)) + 0.5)
+
+@lru_cache(maxsize=32)
+def _box_blur_kernel1d(blur_radius: float) -> np.ndarray:
+    """
+    1D kernel of one of the extended box blur passes behind ImageFilter.GaussianBlur.
+    
+    Pillow splits the variance over BLUR_PASSES boxes with fractional end
+    weights (Gwosdek et al., "Theoretical foundations of Gaussian convolution
+    by extended box filtering"). Memoized per radius (callers round it),
+    since every probe encode of a request uses the same radius; the returned
+    array is shared between callers and therefore read-only.
+    """
+    sigma2 = blur_radius * blur_radius / BLUR_PASSES
+    whole = math.floor((math.sqrt(12 * sigma2 + 1) - 1) / 2)
+    fraction = (2 * whole + 1) * (whole * (whole + 1) - 3 * sigma2)
+    fraction /= 6 * (sigma2 - (whole + 1) * (whole + 1))
+    
+    # Pillow's 24-bit fixed-point weights for the inner taps and the two end taps
+    one = 1 << BLUR_WEIGHT_BITS
+    weight = int(one / (2 * (whole + fraction) + 1))
+    kernel = np.full(2 * whole + 3, weight / one, dtype=np.float32)
+    kernel[[0, -1]] = ((one - (2 * whole + 1) * weight) // 2) / one
+    kernel.flags.writeable = False
+    return kernel
+
+def _contrast_lut(mean: int, contrast_factor: float) -> np.ndarray:
+    """256-entry lookup table blending each level against the mean grey level, truncating like Image.blend."""
+    levels = np.arange(256, dtype=np.float32)
+    return np.clip(
+        np.trunc((levels - mean) * contrast_factor + mean),
+        0,
+        255
+    ).astype(np.uint8)
+
+def _sharpen_rows(
+    arr: np.ndarray,
+    sharp: np.ndarray,
+    sharpness_factor: float,
+    first: int,
+    last: int
+) -> None:
+    """Sharpen rows ``[first, last)`` of ``arr`` into ``sharp``, reading one extra row either side."""
+    top = max(first - 1, 0)
+    bottom = min(last + 1, arr.shape[0])
+    source = arr[top:bottom]
+    
+    # Image.blend of the image with its SMOOTH filtering
+    smooth = cv2.filter2D(source, -1, SMOOTH_KERNEL)
+    tile = cv2.addWeighted(
+        source, sharpness_factor, smooth, 1 - sharpness_factor, TRUNCATE_BIAS, dtype=cv2.CV_8U
+    )
+    
+    # ImageFilter leaves the outermost pixels of the image unfiltered
+    tile[:, [0, -1]] = source[:, [0, -1]]
+    if top == 0:
+        tile[0] = source[0]
+    if bottom == arr.shape[0]:
+        tile[-1] = source[-1]
+    sharp[first:last] = tile[first - top:last - top]
+
+def _contrast_blur_rows(
+    sharp: np.ndarray,
+    out: np.ndarray,
+    lut: np.ndarray,
+    blur_kernel: Optional[np.ndarray],
+    first: int,
+    last: int
+) -> None:
+    """Apply the contrast LUT and blur to rows ``[first, last)`` of ``sharp``, writing into ``out``."""
+    if blur_kernel is None:
+        cv2.LUT(sharp[first:last], lut, dst=out[first:last])
+        return
+    
+    # Every blur pass reaches one kernel radius further into the neighbouring rows
+    halo = BLUR_PASSES * (len(blur_kernel) // 2)
+    top = max(first - halo, 0)
+    bottom = min(last + halo, sharp.shape[0])
+    tile = cv2.LUT(sharp[top:bottom], lut)
+    
+    # Pillow rounds after every pass and clamps at the edges; do the same
+    identity = np.ones(1, dtype=np.float32)
+    for _ in range(BLUR_PASSES):
+        cv2.sepFilter2D(tile, -1, blur_kernel, identity, dst=tile, borderType=cv2.BORDER_REPLICATE)
+    for _ in range(BLUR_PASSES):
+        cv2.sepFilter2D(tile, -1, identity, blur_kernel, dst=tile, borderType=cv2.BORDER_REPLICATE)
+    out[first:last] = tile[first - top:last - top]
+
+def _map_row_tiles(func, height: int, *args) -> None:
+    """Call ``func(*args, first, last)`` for row tiles covering ``height`` rows, one per thread."""
+    tiles = max(1, min(_tile_threads, height // TILE_MIN_ROWS))
+    bounds = [height * i // tiles for i in range(tiles + 1)]
+    if tiles == 1:
+        func(*args, 0, height)
+        return
+    futures = [
+        _tile_executor.submit(func, *args, first, last)
+        for first, last in zip(bounds, bounds[1:])
+    ]
+    for future in futures:
+        future.result()
+
+def _enhance(
+    arr: np.ndarray,
+    out: np.ndarray,
+    sharpness_factor: float,
+    contrast_factor: float,
+    blur_radius: float
+) -> None:
+    """
+    Apply sharpening, contrast and noise blur to an 8-bit image array.
+    
+    Matches ImageEnhance.Sharpness, ImageEnhance.Contrast and
+    ImageFilter.GaussianBlur, in that order: each step saturates to uint8,
+    so they cannot be reordered or merged. Sharpening blends the image with
+    its 3x3 SMOOTH filtering, contrast is a per-level lookup table and the
+    blur Pillow's box passes, run with OpenCV over row tiles in a thread
+    pool so no float image is materialized.
+    
+    ``arr`` is greyscale, RGB or CMYK. The result is written into ``out``, a
+    C-contiguous uint8 array with the same shape as ``arr``; it may be
+    ``arr`` itself, which is only read while sharpening.
+    """
+    height = arr.shape[0]
+    sharp = np.empty_like(arr)
+    _map_row_tiles(_sharpen_rows, height, arr, sharp, sharpness_factor)
+    
+    # Contrast blends against the mean grey level of the sharpened image. In
+    # CMYK that grey is (0, 0, 0, 255 - mean), so each channel gets its own table.
+    mean = _mean_grey(sharp)
+    if _is_cmyk(sharp):
+        lut = np.stack(
+            [_contrast_lut(0, contrast_factor)] * 3 + [_contrast_lut(255 - mean, contrast_factor)],
+            axis=-1
+        )[np.newaxis]
+    else:
+        lut = _contrast_lut(mean, contrast_factor)
+    blur_kernel = _box_blur_kernel1d(round(blur_radius, 3)) if blur_radius > 0 else None
+    _map_row_tiles(_contrast_blur_rows, height, sharp, out, lut, blur_kernel)
+
+def _enhance_image(
+    img: Image.Image,
+    sharpness_factor: float,
+    contrast_factor: float,
+    blur_radius: float
+) -> Image.Image:
+    """
+    Sharpen, boost contrast and denoise ``img``; alpha is left untouched.
+    
+    Copies the pixels out of Pillow once and writes the result back over
+    that copy, so the only other full-size buffer is the sharpened
+    intermediate. An "L" or CMYK result is wrapped as is, but an RGB one is
+    copied into Pillow's padded layout.
+    """
+    color = img.convert(ALPHA_MODES[img.mode]) if img.mode in ALPHA_MODES else img
+    arr = np.array(color)
+    _enhance(arr, arr, sharpness_factor, contrast_factor, blur_radius)
+    
+    if color.mode == "CMYK":
+        # Image.fromarray would read four channels as RGBA
+        enhanced = Image.frombuffer("CMYK", color.size, arr, "raw", "CMYK", 0, 1)
+    else:
+        enhanced = Image.fromarray(arr)
+    if img.mode in ALPHA_MODES:
+        enhanced.putalpha(img.getchannel("A"))
+    return enhanced
+
+def _estimate_scale(
+    base: Image.Image,
+    target_bytes: int,
+    sharpness_factor: float,
+    contrast_factor: float,
+    blur_radius: float,
+    compression: str
+) -> float:
+    """
+    Predict the scale factor at which ``base`` encodes to ``target_bytes``.
+    
+    Encodes an enhanced center crop in memory to measure the compressed
+    bytes per pixel, then solves for the pixel count that fits the target.
+    """
+    width, height = base.size
+    crop_width = min(width, ESTIMATE_CROP_SIZE)
+    crop_height = min(height, ESTIMATE_CROP_SIZE)
+    left = (width - crop_width) // 2
+    top = (height - crop_height) // 2
+    crop = _enhance_image(
+        base.crop((left, top, left + crop_width, top + crop_height)),
+        sharpness_factor,
+        contrast_factor,
+        blur_radius
+    )
+    
+    buffer = io.BytesIO()
+    crop.save(
+        buffer,
+        format="TIFF",
+        compression=compression,
+        tiffinfo={TIFF_PREDICTOR_TAG: HORIZONTAL_PREDICTOR}
+    )
+    bytes_per_pixel = buffer.tell() / (crop_width * crop_height)
+    
+    target_pixels = target_bytes / bytes_per_pixel
+    return math.sqrt(target_pixels / (width * height))
+
+def _scaled_size(
+    size: Tuple[int, int],
+    scale_factor: float,
+    min_size_percentage: float
+) -> Tuple[int, int]:
+    """Dimensions of an image of ``size`` scaled by ``scale_factor``, respecting the minimum size."""
+    original_width, original_height = size
+    min_width = int(original_width * min_size_percentage)
+    min_height = int(original_height * min_size_percentage)
+    new_width = max(int(original_width * scale_factor), min_width, 1)
+    new_height = max(int(original_height * scale_factor), min_height, 1)
+    return new_width, new_height
+
+def _encode_scaled(
+    base: Image.Image,
+    scale_factor: float,
+    min_size_percentage: float,
+    sharpness_factor: float,
+    contrast_factor: float,
+    blur_radius: float,
+    dpi: int,
+    compression: str
+) -> bytes:
+    """
+    Resize, enhance and encode ``base`` at the given scale factor.
+    
+    Returns:
+        bytes: The encoded TIFF, kept in memory until a probe is accepted
+    """
+    # Calculate new dimensions while respecting minimum size
+    new_width, new_height = _scaled_size(base.size, scale_factor, min_size_percentage)
+    
+    # Resize image using high-quality Lanczos resampling (box-reduced first for
+    # large downscales)
+    img_resized = base.resize(
+        (new_width, new_height),
+        Image.Resampling.LANCZOS,
+        reducing_gap=RESIZE_REDUCING_GAP
+    )
+    
+    img_resized = _enhance_image(
+        img_resized,
+        sharpness_factor,
+        contrast_factor,
+        blur_radius
+    )
+    
+    # Encode with compression; DPI goes straight to the encoder, and the
+    # freshly built image carries no other metadata
+    buffer = io.BytesIO()
+    img_resized.save(
+        buffer,
+        format="TIFF",
+        compression=compression,
+        dpi=(dpi, dpi),
+        tiffinfo={TIFF_PREDICTOR_TAG: HORIZONTAL_PREDICTOR}
+    )
+    
+    return buffer.getvalue()
+
+def _vips_load_source(input_file: Path) -> "pyvips.Image":
+    """Open ``input_file`` lazily as an 8-bit greyscale or sRGB libvips image."""
+    source = pyvips.Image.new_from_file(str(input_file))
+    if source.interpretation not in ("b-w", "srgb") or source.format != "uchar":
+        source = source.colourspace("b-w" if source.bands < 3 else "srgb")
+    return source
+
+def _vips_mean_grey(img: "pyvips.Image") -> int:
+    """Mean grey level of ``img``, rounded the way ImageEnhance.Contrast does."""
+    stats = img.stats()
+    if img.bands < 3:
+        return int(stats(4, 1)[0] + 0.5)
+    means = [stats(4, band + 1)[0] for band in range(3)]
+    return int(sum(w * m for w, m in zip(LUMA_WEIGHTS, means)) + 0.5)
+
+def _vips_enhance(
+    img: "pyvips.Image",
+    sharpness_factor: float,
+    contrast_factor: float,
+    blur_radius: float
+) -> "pyvips.Image":
+    """
+    Sharpen, boost contrast and denoise a libvips image; alpha is left untouched.
+    
+    Same steps, rounding and borders as ``_enhance``; libvips fuses them and
+    evaluates them tile by tile across its worker threads when the image is
+    saved.
+    """
+    alpha = None
+    if img.hasalpha():
+        img, alpha = img[:-1], img[-1]
+    
+    # Apply sharpening to enhance text and details; ImageFilter leaves the
+    # outermost pixels unfiltered and Image.blend truncates
+    smoothed = img.conv(pyvips.Image.new_from_array(SMOOTH_KERNEL.tolist()), precision="float")
+    smoothed = smoothed.rint().cast("uchar")
+    if img.width > 2 and img.height > 2:
+        smoothed = img.insert(smoothed.crop(1, 1, img.width - 2, img.height - 2), 1, 1)
+    img = (img * sharpness_factor + smoothed * (1 - sharpness_factor)).cast("uchar")
+    
+    # Enhance contrast for better visibility (blend against the mean grey level)
+    mean = _vips_mean_grey(img)
+    img = img.linear(contrast_factor, mean * (1 - contrast_factor)).cast("uchar")
+    
+    # Apply slight Gaussian blur to reduce noise, as Pillow's rounded box passes
+    if blur_radius > 0:
+        kernel = _box_blur_kernel1d(round(blur_radius, 3)).tolist()
+        horizontal = pyvips.Image.new_from_array([kernel])
+        vertical = pyvips.Image.new_from_array([[weight] for weight in kernel])
+        for mask in [horizontal] * BLUR_PASSES + [vertical] * BLUR_PASSES:
+            img = img.conv(mask, precision="float").rint().cast("uchar")
+    
+    if alpha is not None:
+        img = img.bandjoin(alpha)
+    return img
+
+def _vips_estimate_scale(
+    source: "pyvips.Image",
+    target_bytes: int,
+    sharpness_factor: float,
+    contrast_factor: float,
+    blur_radius: float
+) -> float:
+    """libvips counterpart of ``_estimate_scale``."""
+    crop_width = min(source.width, ESTIMATE_CROP_SIZE)
+    crop_height = min(source.height, ESTIMATE_CROP_SIZE)
+    crop = _vips_enhance(
+        source.crop(
+            (source.width - crop_width) // 2,
+            (source.height - crop_height) // 2,
+            crop_width,
+            crop_height
+        ),
+        sharpness_factor,
+        contrast_factor,
+        blur_radius
+    )
+    encoded = crop.tiffsave_buffer(compression="deflate", predictor="horizontal")
+    bytes_per_pixel = len(encoded) / (crop_width * crop_height)
+    
+    target_pixels = target_bytes / bytes_per_pixel
+    return math.sqrt(target_pixels / (source.width * source.height))
+
+def _vips_encode_scaled(
+    source: "pyvips.Image",
+    scale_factor: float,
+    min_size_percentage: float,
+    sharpness_factor: float,
+    contrast_factor: float,
+    blur_radius: float,
+    dpi: int
+) -> bytes:
+    """
+    libvips counterpart of ``_encode_scaled``.
+    
+    Returns:
+        bytes: The encoded TIFF, kept in memory until a probe is accepted
+    """
+    new_width, new_height = _scaled_size(
+        (source.width, source.height), scale_factor, min_size_percentage
+    )
+    img = source.resize(
+        new_width / source.width,
+        vscale=new_height / source.height,
+        kernel="lanczos3"
+    )
+    img = _vips_enhance(img, sharpness_factor, contrast_factor, blur_radius)
+    
+    # Same Deflate + horizontal predictor encoding as the Pillow path;
+    # libvips resolution is in pixels per millimetre
+    return img.tiffsave_buffer(
+        compression="deflate",
+        predictor="horizontal",
+        xres=dpi / 25.4,
+        yres=dpi / 25.4,
+        resunit="inch",
+        strip=True
+    )
+
 def compress_tiff_file(
     input_file: Union[str, Path],
     target_size_kb: int,
@@ -26,16 +709,21 @@ def compress_tiff_file(
     sharpness_factor: float = 1.5,
     contrast_factor: float = 1.5,
     blur_radius: float = 0.1,
-    dpi: int = 300
+    dpi: int = 300,
+    source_digest: Optional[str] = None,
+    output_file: Optional[Union[str, Path]] = None
 ) -> str:
     """
     Compress a TIFF file while preserving image quality.
     
-    This function implements an iterative compression algorithm that:
-    1. Gradually reduces image dimensions while maintaining aspect ratio
-    2. Applies image enhancements to preserve quality
+    This function implements a model-guided compression algorithm that:
+    1. Predicts the scale that meets the target size from a center-crop
+       encode (encoded size grows with pixel count) and corrects it up or
+       down with a few probe encodes, bisecting if the size model stalls
+    2. Applies image enhancements to preserve quality, through Pillow/OpenCV
+       or, with TIFF_COMPRESSOR_BACKEND=vips, through libvips
     3. Manages DPI settings for optimal output
-    4. Implements LZW compression for TIFF format
+    4. Implements Deflate compression with a horizontal predictor for TIFF format
     
     Args:
         input_file (Union[str, Path]): Path to the input TIFF file
@@ -46,6 +734,12 @@ def compress_tiff_file(
         contrast_factor (float): Factor for contrast enhancement (0.1 to 3.0)
         blur_radius (float): Radius for Gaussian blur to reduce noise (0.0 to 2.0)
         dpi (int): DPI for the output image (> 0)
+        source_digest (Optional[str]): SHA-256 hex digest of the input file; when
+            given, the decoded image is cached in SOURCE_CACHE_DIR and reused
+            by any process for later calls with the same digest (ignored by
+            the libvips backend)
+        output_file (Optional[Union[str, Path]]): Where to write the result;
+            defaults to ``compressed_<input name>`` in the working directory
     
     Returns:
         str: Path to the compressed output file
@@ -65,60 +759,136 @@ def compress_tiff_file(
         raise FileNotFoundError(f"Input file not found: {input_file}")
     
     # Prepare output filename
-    output_file = f"compressed_{os.path.basename(input_file)}"
-    compression = "tiff_lzw"  # Use LZW compression for better results
-    
-    # Get original image dimensions
-    with Image.open(input_file) as img:
-        original_width, original_height = img.size
-    
-    while True:
-        with Image.open(input_file) as img:
-            # Calculate new dimensions while respecting minimum size
-            min_width = int(original_width * min_size_percentage)
-            min_height = int(original_height * min_size_percentage)
-            new_width = max(int(img.width * scale_factor), min_width)
-            new_height = max(int(img.height * scale_factor), min_height)
-            
-            # Resize image using high-quality Lanczos resampling
-            img_resized = img.resize(
-                (new_width, new_height),
-                Image.Resampling.LANCZOS
+    if output_file is None:
+        output_file = f"compressed_{os.path.basename(input_file)}"
+    output_file = str(output_file)
+    compression = "tiff_adobe_deflate"  # Deflate + predictor beats LZW on size and speed
+    
+    target_bytes = target_size_kb * 1024
+    min_scale = max(min_size_percentage, MIN_SCALE_FACTOR)
+    
+    if BACKEND == "vips":
+        # libvips streams decode -> resize -> enhance -> encode in tiles, so the
+        # full decoded image is never held in memory
+        source = _vips_load_source(input_file)
+        
+        def render(scale: float) -> bytes:
+            return _vips_encode_scaled(
+                source,
+                scale,
+                min_size_percentage,
+                sharpness_factor,
+                contrast_factor,
+                blur_radius,
+                dpi
             )
-            
-            # Apply sharpening to enhance text and details
-            enhancer = ImageEnhance.Sharpness(img_resized)
-            img_resized = enhancer.enhance(sharpness_factor)
-            
-            # Enhance contrast for better visibility
-            contrast_enhancer = ImageEnhance.Contrast(img_resized)
-            img_resized = contrast_enhancer.enhance(contrast_factor)
-            
-            # Apply slight Gaussian blur to reduce noise
-            if blur_radius > 0:
-                img_resized = img_resized.filter(
-                    ImageFilter.GaussianBlur(radius=blur_radius)
-                )
-            
-            # Set DPI for better clarity
-            img_resized.info['dpi'] = (dpi, dpi)
-            
-            # Remove metadata to reduce file size
-            img_resized.info = {'dpi': (dpi, dpi)}
-            
-            # Save with compression
-            img_resized.save(
-                output_file,
-                format="TIFF",
-                compression=compression
+        
+        # Start from the scale a crop encode predicts, so usually one full encode suffices
+        estimated_scale = _vips_estimate_scale(
+            source,
+            target_bytes,
+            sharpness_factor,
+            contrast_factor,
+            blur_radius
+        )
+    else:
+        # Decode the source once (or reuse a cached decode); every probe resizes from it
+        base = _load_source(input_file, source_digest)
+        
+        def render(scale: float) -> bytes:
+            return _encode_scaled(
+                base,
+                scale,
+                min_size_percentage,
+                sharpness_factor,
+                contrast_factor,
+                blur_radius,
+                dpi,
+                compression
             )
         
-        # Check if target size achieved
-        output_size_kb = os.path.getsize(output_file) / 1024
-        if output_size_kb <= target_size_kb or scale_factor <= 0.1:
+        # Start from the scale a crop encode predicts, so usually one full encode suffices
+        estimated_scale = _estimate_scale(
+            base,
+            target_bytes,
+            sharpness_factor,
+            contrast_factor,
+            blur_radius,
+            compression
+        )
+    
+    # The caller's scale factor caps the search, the minimum size bounds it below
+    max_scale = max(scale_factor, min_scale)
+    scale_factor = max(
+        min(max_scale, estimated_scale * SCALE_SAFETY_MARGIN),
+        min_scale
+    )
+    # Probes are encoded in memory; only the accepted one is written to disk.
+    # Keep the largest encode that fits and the smallest scale that does not.
+    best = None
+    best_scale = 0.0
+    over_scale = None
+    
+    def probe(scale: float) -> bytes:
+        nonlocal best, best_scale, over_scale
+        encoded = render(scale)
+        if len(encoded) <= target_bytes:
+            if scale > best_scale:
+                best, best_scale = encoded, scale
+        elif over_scale is None or scale < over_scale:
+            over_scale = scale
+        return encoded
+    
+    encoded = probe(scale_factor)
+    
+    def underfilled() -> bool:
+        return len(best) < target_bytes * SCALE_FILL_RATIO and best_scale < max_scale
+    
+    for _ in range(MAX_SCALE_PROBES):
+        if best is None:
+            if scale_factor <= min_scale:
+                break
+        elif not underfilled():
             break
         
-        # Reduce scale factor for next iteration
-        scale_factor *= 0.9
+        # Encoded size grows roughly with the pixel count, i.e. with the square
+        # of the scale factor, so jump straight to the predicted scale. The
+        # crop estimate misses both ways (a busy center on a plain page comes
+        # out far too small), so the correction goes up as well as down.
+        scale_factor = min(
+            max(
+                scale_factor * math.sqrt(target_bytes / len(encoded)) * SCALE_SAFETY_MARGIN,
+                min_scale
+            ),
+            max_scale
+        )
+        if best is not None and over_scale is not None:
+            if over_scale <= best_scale:
+                break
+            if not best_scale < scale_factor < over_scale:
+                # The model points outside the scales left to try; split them instead
+                scale_factor = (best_scale + over_scale) / 2
+        encoded = probe(scale_factor)
+    
+    low = best_scale if best is not None else min_scale
+    if over_scale is not None and over_scale > low and (best is None or underfilled()):
+        # The size model stalled: size is not monotonic in scale (Lanczos adds
+        # grey antialiasing to bilevel pages), so bisect below the smallest
+        # over-target scale rather than settle for a far smaller size
+        high = over_scale
+        for _ in range(MAX_BISECTION_STEPS):
+            middle = (low + high) / 2
+            if len(probe(middle)) <= target_bytes:
+                low = middle
+            else:
+                high = middle
+    
+    if best is not None:
+        encoded = best
+    elif over_scale > min_scale:
+        # Nothing above the floor fits; settle for the smallest allowed size.
+        # Otherwise the last probe already was the floor.
+        encoded = render(min_scale)
     
-    return output_file
\ No newline at end of file
+    Path(output_file).write_bytes(encoded)
+    return output_file